@@ -1,24 +1,67 @@
 #!/usr/bin/env python3
 from zeroconf import Zeroconf, ServiceInfo
+from zeroconf.asyncio import AsyncZeroconf
 import socket
-import time
+import struct
+import asyncio
+import platform
+import atexit
 import logging
+import functools
+import threading
 import netifaces
 import argparse
 
+_IS_LINUX = platform.system().lower() == "linux"
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger("mDNS")
 
+SIOCGIFADDR = 0x8915
+
+@functools.lru_cache(maxsize=8)
+def ioctl_interface_ip(interface_name):
+    """Get the IPv4 address of an interface with a single SIOCGIFADDR ioctl"""
+    ifreq = struct.pack('256s', interface_name.encode()[:15])
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        return socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, ifreq)[20:24])
+
 def get_interface_ip(interface_name):
     try:
-        addrs = netifaces.ifaddresses(interface_name)
-        ip = addrs[netifaces.AF_INET][0]['addr']
+        if _IS_LINUX and fcntl is not None:
+            ip = ioctl_interface_ip(interface_name)
+        else:
+            addrs = netifaces.ifaddresses(interface_name)
+            ip = addrs[netifaces.AF_INET][0]['addr']
         logger.debug(f"Detected local IP for {interface_name}: {ip}")
         return ip
     except Exception as e:
         logger.error(f"Could not get IP for interface {interface_name}: {e}")
         return None
 
+@functools.lru_cache(maxsize=None)
+def get_zeroconf(local_ip):
+    """Shared Zeroconf instance bound to a local IP, closed at exit"""
+    zeroconf = Zeroconf(interfaces=[local_ip])
+    atexit.register(zeroconf.close)
+    return zeroconf
+
+def build_service_info(hostname, domain, packed_address):
+    """Build the workstation service announcing a packed IPv4 address as hostname.domain"""
+    return ServiceInfo(
+        type_="_workstation._tcp.local.",
+        name=f"{hostname}._workstation._tcp.local.",
+        addresses=[packed_address],  # Announce the foreign IP
+        port=0,
+        properties={'description': 'Custom IP device'},
+        server=f"{hostname}.{domain}."
+    )
+
 def announce_mdns_hostname(hostname="testdevice", domain="local", ip_address=None, interface_name="wlan0"):
     """
     Announce an mDNS hostname with a specified IP address.
@@ -35,7 +78,7 @@ def announce_mdns_hostname(hostname="testdevice", domain="local", ip_address=Non
 
     # Validate IP address format
     try:
-        socket.inet_aton(ip_address)
+        packed_address = socket.inet_aton(ip_address)
         logger.debug(f"Valid IP address to announce: {ip_address}")
     except socket.error:
         logger.error(f"Invalid IP address: {ip_address}. Please provide a valid IPv4 address.")
@@ -52,47 +95,95 @@ def announce_mdns_hostname(hostname="testdevice", domain="local", ip_address=Non
     full_hostname = f"{hostname}.{domain}."
 
     # Announce the specified IP with local binding
-    service_info = ServiceInfo(
-        type_="_workstation._tcp.local.",
-        name=f"{hostname}._workstation._tcp.local.",
-        addresses=[socket.inet_aton(ip_address)],  # Announce the foreign IP
-        port=0,
-        properties={'description': 'Custom IP device'},
-        server=full_hostname
-    )
+    service_info = build_service_info(hostname, domain, packed_address)
 
     # Bind to local interface IP
-    zeroconf = Zeroconf(interfaces=[local_ip])
+    zeroconf = get_zeroconf(local_ip)
 
     try:
         logger.info(f"Registering {full_hostname} at {ip_address}")
         zeroconf.register_service(service_info)
         logger.info("Hostname announced. Press Ctrl+C to stop...")
-        while True:
-            time.sleep(5)
-            #logger.debug("Service still running...")
+        # Sleep until interrupted. The hourly timeout keeps Ctrl+C working on
+        # Windows, where an untimed Event.wait() can't be interrupted
+        stop = threading.Event()
+        try:
+            while not stop.wait(3600):
+                pass
+        except KeyboardInterrupt:
+            pass
     except Exception as e:
         logger.error(f"Error during announcement: {e}")
     finally:
         logger.info("Unregistering hostname...")
         zeroconf.unregister_service(service_info)
-        zeroconf.close()
+        logger.info("Hostname announcement stopped")
+
+async def announce_many(records, domain="local", interface_name="wlan0"):
+    """
+    Announce several mDNS hostnames at once.
+
+    All services are registered concurrently so their probes share a single
+    probe window instead of taking about one second each.
+
+    Args:
+        records (list): (hostname, ip_address) pairs to announce
+        domain (str): The domain (typically "local")
+        interface_name (str): Network interface to bind to (e.g., "wlan0")
+    """
+    service_infos = []
+    for hostname, ip_address in records:
+        try:
+            packed_address = socket.inet_aton(ip_address)
+        except socket.error:
+            logger.error(f"Invalid IP address for {hostname}: {ip_address}. Please provide a valid IPv4 address.")
+            return
+        service_infos.append(build_service_info(hostname, domain, packed_address))
+
+    local_ip = get_interface_ip(interface_name)
+    if not local_ip:
+        logger.error("Failed to get local IP address. Aborting.")
+        return
+
+    logger.info(f"Binding to local IP: {local_ip} on interface: {interface_name}")
+    azc = AsyncZeroconf(interfaces=[local_ip])
+
+    try:
+        for hostname, ip_address in records:
+            logger.info(f"Registering {hostname}.{domain}. at {ip_address}")
+        # Each call returns once its probe is scheduled, the returned tasks complete after announcing
+        tasks = await asyncio.gather(*(azc.async_register_service(info) for info in service_infos))
+        await asyncio.gather(*tasks)
+        logger.info("Hostnames announced. Press Ctrl+C to stop...")
+        await asyncio.Event().wait()
+    except Exception as e:
+        logger.error(f"Error during announcement: {e}")
+    finally:
+        logger.info("Unregistering hostnames...")
+        await azc.async_unregister_all_services()
+        await azc.async_close()
         logger.info("Hostname announcement stopped")
 
 if __name__ == "__main__":
     # Set up command-line argument parsing
     parser = argparse.ArgumentParser(description="Announce an mDNS hostname with a specified IP.")
-    parser.add_argument("--name", default="testdevice", help="Hostname to announce (default: testdevice)")
-    parser.add_argument("--ip", required=True, help="IP address to announce (e.g., 192.168.1.100)")
+    parser.add_argument("--name", action="append", help="Hostname to announce, repeat with --ip for several devices (default: testdevice)")
+    parser.add_argument("--ip", action="append", required=True, help="IP address to announce (e.g., 192.168.1.100)")
     parser.add_argument("--interface", default="wlan0", help="Network interface to bind to (default: wlan0)")
 
     args = parser.parse_args()
+    names = args.name or ["testdevice"]
+    if len(names) != len(args.ip):
+        parser.error("--name and --ip must be given the same number of times")
 
     try:
-        announce_mdns_hostname(
-            hostname=args.name,
-            ip_address=args.ip,
-            interface_name=args.interface
-        )
+        if len(names) == 1:
+            announce_mdns_hostname(
+                hostname=names[0],
+                ip_address=args.ip[0],
+                interface_name=args.interface
+            )
+        else:
+            asyncio.run(announce_many(list(zip(names, args.ip)), interface_name=args.interface))
     except KeyboardInterrupt:
         logger.info("\nStopped by user")
\ No newline at end of file
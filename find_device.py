@@ -1,132 +1,499 @@
 #!/usr/bin/env python3
 import os
+import sys
 import re
+import errno
+import threading
+import struct
+import asyncio
 import platform
 import argparse
 import subprocess
 import socket
+import functools
+import itertools
+from contextlib import aclosing
 from concurrent.futures import ThreadPoolExecutor
 
+_SYSTEM = platform.system().lower()
+_IS_WINDOWS = _SYSTEM == "windows"
+_IS_LINUX = _SYSTEM == "linux"
+
 try:
     import netifaces
 except ImportError:
     print("Please install netifaces: pip install netifaces")
     exit(1)
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from icmplib import async_ping, ICMPv4Socket, ICMPLibError
+except ImportError:
+    async_ping = None
+
+try:
+    from pyroute2 import IPRoute
+except ImportError:
+    IPRoute = None
+
+# Netlink handle shared by every interface and neighbour query of the process
+_NL = None
+_NL_LOCK = threading.Lock()
+# The sync IPRoute of pyroute2 >= 0.9 drives its own event loop, which fails
+# inside asyncio.run, so the coroutines hand all netlink work to this thread
+_NL_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='netlink')
+
+async def in_netlink_thread(func, *args):
+    """Run a blocking netlink function on the netlink thread"""
+    return await asyncio.get_running_loop().run_in_executor(_NL_EXECUTOR, func, *args)
+
+def get_netlink():
+    """Shared netlink handle, opened on first use. None if netlink is unavailable"""
+    global _NL
+    with _NL_LOCK:
+        if _NL is None:
+            # False marks netlink as unavailable so it isn't retried on every call
+            _NL = False
+            if IPRoute is not None and _IS_LINUX:
+                try:
+                    _NL = IPRoute()
+                except Exception:
+                    # Whatever the reason, the ioctl and ARP table paths still work
+                    _NL = False
+    return _NL if _NL is not False else None
+
+def close_netlink():
+    """Close the shared netlink handle, on the netlink thread that owns its event loop"""
+    global _NL
+    if _NL:
+        _NL_EXECUTOR.submit(_NL.close).result()
+    _NL = None
+
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+
+@functools.lru_cache(maxsize=8)
+def ioctl_interface_ipv4(interface):
+    """Get IPv4 address and netmask of an interface with two ioctls instead of enumerating every interface
+
+    Only used on Linux when netlink is unavailable (pyroute2 not installed or failing).
+    """
+    ifreq = struct.pack('256s', interface.encode()[:15])
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        ip = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, ifreq)[20:24])
+        netmask = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFNETMASK, ifreq)[20:24])
+    return ip, netmask
+
 def get_network_info(interface):
-    """Get IPv4 network information for specified interface"""
+    """Get IPv4 address and prefix length for specified interface"""
+    nl = get_netlink()
+    if nl is not None:
+        try:
+            with _NL_LOCK:
+                addrs = nl.get_addr(label=interface, family=socket.AF_INET)
+            return addrs[0].get_attr('IFA_ADDRESS'), addrs[0]['prefixlen']
+        except (IndexError, KeyError):
+            return None, None
+        except Exception:
+            # Netlink query failed, try the ioctls below
+            pass
+
     try:
-        addresses = netifaces.ifaddresses(interface)
-        ipv4_info = addresses.get(netifaces.AF_INET, [{}])[0]
-        return ipv4_info.get('addr'), ipv4_info.get('netmask')
-    except (ValueError, KeyError, IndexError):
+        if _IS_LINUX and fcntl is not None:
+            ip, netmask = ioctl_interface_ipv4(interface)
+        else:
+            addresses = netifaces.ifaddresses(interface)
+            ipv4_info = addresses.get(netifaces.AF_INET, [{}])[0]
+            ip, netmask = ipv4_info.get('addr'), ipv4_info.get('netmask')
+        if not ip or not netmask:
+            return None, None
+        return ip, bin(struct.unpack('!I', socket.inet_aton(netmask))[0]).count('1')
+    except (ValueError, KeyError, IndexError, OSError):
         return None, None
 
-def calculate_network(ip, netmask):
-    """Calculate network range from IP and netmask"""
-    ip_parts = list(map(int, ip.split('.')))
-    mask_parts = list(map(int, netmask.split('.')))
-    
-    network_parts = [ip & mask for ip, mask in zip(ip_parts, mask_parts)]
-    broadcast_parts = [(ip | (~mask & 0xff)) for ip, mask in zip(ip_parts, mask_parts)]
-    
-    start_ip = network_parts.copy()
-    start_ip[-1] += 1
-    end_ip = broadcast_parts.copy()
-    end_ip[-1] -= 1
-    
-    base_network = '.'.join(map(str, network_parts[:3]))
-    return [f"{base_network}.{i}" for i in range(start_ip[-1], end_ip[-1]+1)]
-
-def ping_host(ip):
+def ip_to_int(ip):
+    """uint32 of a dotted-quad IPv4 address"""
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+# Largest network swept without an explicit --max-hosts: a /16
+MAX_HOSTS = 65534
+
+def iter_hosts(ip, prefixlen):
+    """Host addresses of the network of ip/prefixlen as a range of uint32"""
+    size = 1 << (32 - prefixlen)
+    base = ip_to_int(ip) & ~(size - 1)
+    if size <= 2:
+        # /31 and /32 have no network or broadcast address
+        return range(base, base + size)
+    return range(base + 1, base + size - 1)
+
+def int_to_ip(host):
+    """Dotted-quad string of a uint32 IPv4 address"""
+    return socket.inet_ntoa(struct.pack('!I', host))
+
+if _IS_WINDOWS:
+    _PING_COMMAND = ('ping', '-n', '1', '-w', '1000')
+else:
+    _PING_COMMAND = ('ping', '-c', '1', '-W', '1')
+
+async def ping_host(ip):
     """Ping a host using system ping command"""
     try:
-        if platform.system().lower() == "windows":
-            command = ['ping', '-n', '1', '-w', '1000', ip]
-        else:
-            command = ['ping', '-c', '1', '-W', '1', ip]
-        
-        with open(os.devnull, 'w') as devnull:
-            return subprocess.call(command, stdout=devnull, stderr=devnull) == 0
-    except:
+        process = await asyncio.create_subprocess_exec(
+            *_PING_COMMAND, ip, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        return await process.wait() == 0
+    except Exception:
+        return False
+
+async def icmplib_ping_host(ip):
+    """Ping a host through an unprivileged icmplib socket"""
+    try:
+        host = await async_ping(ip, count=1, timeout=1, privileged=False)
+        return host.is_alive
+    except ICMPLibError:
         return False
 
+def icmplib_available():
+    """Check that icmplib is installed and allowed to open unprivileged ICMP sockets"""
+    if async_ping is None:
+        return False
+    try:
+        ICMPv4Socket(privileged=False).close()
+        return True
+    except ICMPLibError:
+        return False
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+# Room for the replies of a large sweep, capped by net.core.rmem_max
+RECV_BUFFER_SIZE = 4 * 1024 * 1024
+
+def icmp_checksum(data):
+    """RFC 1071 internet checksum"""
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+class SweepPinger:
+    """Ping many hosts through a single raw ICMP socket
+
+    Each target gets its own (ident, sequence) pair so replies can be
+    matched back to the target without opening one socket per host.
+    Opening the socket requires root (raises PermissionError otherwise).
+    """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        self.sock.setblocking(False)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+        self.ident_base = os.getpid()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def send_echo(self, ip, ident, seq):
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+        checksum = icmp_checksum(header)
+        self.sock.sendto(struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, ident, seq), (ip, 0))
+
+    def match_reply(self, packet, pending):
+        """Return the pending target a packet is the echo reply of, if any"""
+        # Raw sockets deliver the IP header in front of the ICMP message
+        header_len = (packet[0] & 0x0f) * 4
+        if len(packet) < header_len + 8:
+            return None
+        source, = struct.unpack_from('!I', packet, 12)
+        icmp_type, _, _, ident, seq = struct.unpack_from('!BBHHH', packet, header_len)
+        if icmp_type == ICMP_ECHO_REPLY and pending.get((ident, seq)) == source:
+            return pending.pop((ident, seq))
+        return None
+
+    def drain_replies(self, pending):
+        """Read every reply already queued on the socket, without blocking"""
+        replied = []
+        while True:
+            try:
+                packet = self.sock.recv(1024)
+            except BlockingIOError:
+                return replied
+            host = self.match_reply(packet, pending)
+            if host is not None:
+                replied.append(host)
+
+    async def sweep(self, target_ips, timeout=1):
+        """Send one echo request to every target (uint32) and yield the ones that reply"""
+        loop = asyncio.get_running_loop()
+        pending = {}
+        for index, host in enumerate(target_ips):
+            key = ((self.ident_base + index) & 0xffff, (index >> 16) & 0xffff)
+            while True:
+                try:
+                    self.send_echo(int_to_ip(host), *key)
+                    pending[key] = host
+                except BlockingIOError:
+                    # Send buffer full, let it drain
+                    await asyncio.sleep(0.001)
+                    continue
+                except OSError:
+                    pass
+                break
+            # Read replies while still sending, or the receive buffer overflows
+            # and the kernel drops them once many hosts are up
+            for replied in self.drain_replies(pending):
+                yield replied
+
+        deadline = loop.time() + timeout
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                packet = await asyncio.wait_for(loop.sock_recv(self.sock, 1024), remaining)
+            except asyncio.TimeoutError:
+                break
+            host = self.match_reply(packet, pending)
+            if host is not None:
+                yield host
+
+async def bounded_sweep(ping, target_ips, concurrency):
+    """Run ping(ip) on every target, at most `concurrency` at a time, and yield the targets that replied"""
+
+    async def ping_target(host):
+        return host, await ping(int_to_ip(host))
+
+    targets = iter(target_ips)
+    in_flight = set()
+    try:
+        while True:
+            # Only create tasks for free slots so memory stays flat on large networks
+            for host in itertools.islice(targets, concurrency - len(in_flight)):
+                in_flight.add(asyncio.ensure_future(ping_target(host)))
+            if not in_flight:
+                break
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                host, alive = task.result()
+                if alive:
+                    yield host
+    finally:
+        # Drop the pings still pending when the caller stops early
+        for task in in_flight:
+            task.cancel()
+
+async def ping_sweep(target_ips):
+    """Ping all target IPs (uint32) and yield those that replied, as soon as they reply"""
+    try:
+        pinger = SweepPinger()
+    except PermissionError:
+        pinger = None
+    if pinger is not None:
+        with pinger:
+            async for host in pinger.sweep(target_ips):
+                yield host
+        return
+
+    if icmplib_available():
+        ping, concurrency = icmplib_ping_host, 512
+    else:
+        # No ICMP socket available, fall back to the system ping command
+        ping, concurrency = ping_host, 100
+    async for host in bounded_sweep(ping, target_ips, concurrency):
+        yield host
+
+# Every byte except lowercase hex digits, for bytes.translate to delete
+_NON_HEX = bytes(c for c in range(256) if chr(c) not in '0123456789abcdef')
+# One `arp -a` line: "? (192.168.1.1) at aa:bb:..." (macOS) or "  192.168.1.1  aa-bb-..." (Windows)
+_ARP_RE = re.compile(r'\(?(\d{1,3}(?:\.\d{1,3}){3})\)?\s.*?((?:[0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2})')
+
 def normalize_mac(mac):
     """Standardize MAC address format"""
     if not mac:
         return None
     try:
-        mac = re.sub(r'[^0-9a-fA-F]', '', mac).lower()
+        mac = mac.lower().encode('ascii', 'ignore').translate(None, _NON_HEX).decode()
         if len(mac) != 12:
             return None
         return ':'.join([mac[i:i+2] for i in range(0, 12, 2)])
-    except TypeError:
+    except (TypeError, AttributeError):
+        return None
+
+def parse_arp_output(output):
+    """Parse `arp -a` output into {ip: mac}"""
+    table = {}
+    for line in output.splitlines():
+        match = _ARP_RE.search(line)
+        if match:
+            table.setdefault(match.group(1), match.group(2))
+    return table
+
+SIOCGARP = 0x8954
+ATF_COM = 0x02
+
+def ioctl_arp(ip, interface):
+    """Fetch the ARP entry of a single IP from the kernel with SIOCGARP"""
+    # struct arpreq: arp_pa (sockaddr_in), arp_ha, arp_flags, arp_netmask, arp_dev
+    request = struct.pack('=H2x4s8x16xi16x16s', socket.AF_INET, socket.inet_aton(ip), 0, interface.encode())
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        reply = fcntl.ioctl(sock.fileno(), SIOCGARP, request)
+    flags, = struct.unpack_from('=i', reply, 32)
+    if not flags & ATF_COM:
         return None
+    return ':'.join(f'{b:02x}' for b in reply[18:24])
+
+def read_proc_arp(interface):
+    """Parse /proc/net/arp into {ip: mac} for one interface in a single pass over its bytes"""
+    with open('/proc/net/arp', 'rb') as f:
+        data = f.read()
+    device = interface.encode()
+    table = {}
+    for line in data.split(b'\n')[1:]:
+        parts = line.split()
+        if len(parts) >= 6 and parts[5] == device and parts[3] != b'00:00:00:00:00:00':
+            table[parts[0].decode()] = parts[3].decode()
+    return table
 
 def get_mac(ip, interface):
     """Get MAC address from ARP cache with interface filtering"""
-    system = platform.system()
     try:
-        if system == "Linux":
-            with open('/proc/net/arp') as f:
-                arp_table = f.readlines()
-            for line in arp_table[1:]:
-                parts = line.split()
-                if len(parts) >= 6 and parts[0] == ip and parts[5] == interface and parts[3] != '00:00:00:00:00:00':
-                    return parts[3]
+        if _IS_LINUX:
+            try:
+                return ioctl_arp(ip, interface)
+            except OSError as e:
+                # ENXIO: the kernel has no entry for this IP
+                if e.errno == errno.ENXIO:
+                    return None
+            return read_proc_arp(interface).get(ip)
         else:
             result = subprocess.run(['arp', '-a'], capture_output=True, text=True)
-            pattern = re.compile(rf"{re.escape(ip)}\s.*?(([0-9A-Fa-f]{{2}}[:-]){{5}}[0-9A-Fa-f]{{2}})")
-            match = pattern.search(result.stdout)
-            return match.group(1) if match else None
-        return None
+            return parse_arp_output(result.stdout).get(ip)
     except Exception as e:
         return None
 
-def scan_network(interface, target_mac=None, quiet=None):
+NUD_REACHABLE = 0x02
+NUD_PERMANENT = 0x80
+
+def netlink_neighbours(interface):
+    """Dump the neighbour table of an interface over netlink as (ip, mac, NUD state) tuples"""
+    nl = get_netlink()
+    with _NL_LOCK:
+        ifindex = nl.link_lookup(ifname=interface)[0]
+        neighbours = nl.get_neighbours(family=socket.AF_INET, ifindex=ifindex)
+    return [(n.get_attr('NDA_DST'), n.get_attr('NDA_LLADDR'), n['state']) for n in neighbours
+            if n.get_attr('NDA_LLADDR') not in (None, '00:00:00:00:00:00')]
+
+def get_neighbours(interface):
+    """Dump the ARP cache of an interface as {ip: mac} without netlink
+
+    Reads /proc/net/arp on Linux and `arp -a` elsewhere. Returns None if the
+    cache can't be read. With netlink, use netlink_neighbours instead.
+    """
+    try:
+        if _IS_LINUX:
+            return read_proc_arp(interface)
+        result = subprocess.run(['arp', '-a'], capture_output=True, text=True)
+        return parse_arp_output(result.stdout)
+    except Exception:
+        return None
+
+async def ping_one(ip):
+    """Check a single host with one echo request"""
+    async with aclosing(ping_sweep([ip_to_int(ip)])) as replies:
+        async for _ in replies:
+            return True
+    return False
+
+async def find_in_arp_cache(interface, target_mac):
+    """Return the IP the ARP cache holds for target_mac, or None
+
+    Entries netlink reports REACHABLE or PERMANENT are trusted as is. Any other
+    entry (STALE, or read from /proc/net/arp or `arp -a` which carry no state)
+    may be an address the device has since left, so it is confirmed with one echo.
+    """
+    entries = []
+    if await in_netlink_thread(get_netlink) is not None:
+        try:
+            entries = await in_netlink_thread(netlink_neighbours, interface)
+        except Exception:
+            pass
+    else:
+        entries = [(ip, mac, 0) for ip, mac in (get_neighbours(interface) or {}).items()]
+
+    matches = [(ip, state) for ip, mac, state in entries if normalize_mac(mac) == target_mac]
+    # Try the entries the kernel has confirmed recently first
+    matches.sort(key=lambda match: not match[1] & (NUD_REACHABLE | NUD_PERMANENT))
+    for known_ip, state in matches:
+        if state & (NUD_REACHABLE | NUD_PERMANENT) or await ping_one(known_ip):
+            return known_ip
+    return None
+
+async def scan_network(interface, target_mac=None, quiet=None, max_hosts=MAX_HOSTS):
     """Main scanning function"""
-    ip, netmask = get_network_info(interface)
-    if not ip or not netmask:
+    ip, prefixlen = await in_netlink_thread(get_network_info, interface)
+    if not ip or prefixlen is None:
         print(f"Interface {interface} has no IPv4 address or invalid configuration")
         return []
 
-    target_ips = calculate_network(ip, netmask)
-    active_devices = []
-
-    with ThreadPoolExecutor(max_workers=100) as executor:
-        futures = {executor.submit(ping_host, ip): ip for ip in target_ips}
-        for future in futures:
-            ip = futures[future]
-            try:
-                if future.result():
-                    active_devices.append(ip)
-            except:
-                pass
-
     if target_mac:
         target_mac = normalize_mac(target_mac)
         if not target_mac:
             print("Invalid MAC address format")
             return []
-        
         if not quiet:
             print(f"Searching for MAC: {target_mac}")
-        for ip in active_devices:
-            found_mac = get_mac(ip, interface)
-            if found_mac and normalize_mac(found_mac) == target_mac:
-                return [ip]
+        # The kernel often already knows the device, no need to sweep then
+        known_ip = await find_in_arp_cache(interface, target_mac)
+        if known_ip:
+            return [known_ip]
+
+    target_ips = iter_hosts(ip, prefixlen)
+    if len(target_ips) > max_hosts:
+        print(f"Network {ip}/{prefixlen} has {len(target_ips)} hosts, more than the maximum of {max_hosts}. "
+              f"Raise it with --max-hosts to scan anyway", file=sys.stderr)
         return []
+    active_devices = set()
 
-    return sorted(active_devices, key=lambda x: tuple(map(int, x.split('.'))))
+    async with aclosing(ping_sweep(target_ips)) as replies:
+        async for host in replies:
+            if not target_mac:
+                active_devices.add(host)
+                continue
+            # Check each device as soon as it replies and stop the sweep on a match
+            found_mac = get_mac(int_to_ip(host), interface)
+            if found_mac and normalize_mac(found_mac) == target_mac:
+                return [int_to_ip(host)]
+
+    if target_mac:
+        # A reply may have been lost while the kernel still learned the device
+        known_ip = await find_in_arp_cache(interface, target_mac)
+        return [known_ip] if known_ip else []
+    return [int_to_ip(host) for host in sorted(active_devices)]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='ICMP Network Scanner')
     parser.add_argument('interface', help='Network interface name (e.g., eth0, en0)')
     parser.add_argument('--mac', help='MAC address to search for')
     parser.add_argument('-q', '--quiet', action='store_true', help='Output only IP addresses')
+    parser.add_argument('--max-hosts', type=int, default=MAX_HOSTS,
+                        help=f'Refuse to scan networks with more hosts than this (default: {MAX_HOSTS}, a /16)')
     args = parser.parse_args()
 
-    devices = scan_network(args.interface, args.mac, args.quiet)
+    try:
+        devices = asyncio.run(scan_network(args.interface, args.mac, args.quiet, args.max_hosts))
+    finally:
+        close_netlink()
 
     if args.quiet:
         print('\n'.join(devices))